@@ -0,0 +1,392 @@
+"""
+DuckMail 异步客户端
+
+与 DuckMailClient 接口一致，基于 httpx.AsyncClient（HTTP/2 + 连接复用），
+适合在事件循环中并发处理大量邮箱的注册与验证码轮询。
+"""
+
+import asyncio
+import os
+import time
+from typing import Optional
+
+import httpx
+
+from core.duckmail_common import (
+    DEFAULT_DOMAIN,
+    TOKEN_TTL,
+    AccountGoneError,
+    AuthExpiredError,
+    backoff_delay,
+    build_messages_params,
+    extract_code_from_payload,
+    generate_credentials,
+    is_login_rejected,
+    json_body,
+    make_logger,
+    select_candidates,
+)
+from core.proxy_utils import is_proxy_error
+
+
+class AsyncDuckMailClient:
+    """DuckMail异步客户端"""
+
+    # 可用域名缓存（按 (base_url, api_key) 区分，所有实例共享）
+    _domain_cache: dict[tuple, str] = {}
+
+    def __init__(
+        self,
+        base_url: str = "https://api.duckmail.sbs",
+        proxy: str = "",
+        verify_ssl: bool = True,
+        api_key: str = "",
+        log_callback=None,
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.verify_ssl = verify_ssl
+        self.proxy = proxy
+        self.api_key = api_key.strip()
+        self.log_callback = log_callback
+        self._log = make_logger(log_callback)
+
+        self.email: Optional[str] = None
+        self.password: Optional[str] = None
+        self.account_id: Optional[str] = None
+        self.token: Optional[str] = None
+        self._token_acquired_at: float = 0.0
+        self._token_ttl = TOKEN_TTL
+        # 最近一次登录是否被服务端明确拒绝（4xx），网络异常或 5xx 不算
+        self._login_rejected = False
+
+        self._messages_etag: Optional[str] = None
+        self._messages_params: Optional[dict] = None
+        self._messages_cache: list = []
+        self._message_details: dict[str, dict] = {}
+
+        self._client = self._build_client(proxy or None)
+        # 代理失败时使用的直连客户端，首次回退时才创建
+        self._direct_client: Optional[httpx.AsyncClient] = None
+
+    def _build_client(self, proxy: Optional[str]) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=True,
+            verify=self.verify_ssl,
+            proxy=proxy,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            timeout=15,
+        )
+
+    async def aclose(self) -> None:
+        """关闭连接池"""
+        await self._client.aclose()
+        if self._direct_client is not None:
+            await self._direct_client.aclose()
+
+    async def __aenter__(self) -> "AsyncDuckMailClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.aclose()
+
+    def set_credentials(self, email: str, password: str) -> None:
+        self.email = email
+        self.password = password
+
+    async def _request(self, method: str, path: str, use_token: bool = True, **kwargs) -> httpx.Response:
+        """发送请求并打印详细日志
+
+        use_token=False 时不附加邮箱 Token，仅使用 api_key（注册、登录、获取域名）
+        """
+        # 复制一份，避免把认证头写回调用方的 dict（重试时会带上旧 Token）
+        headers = dict(kwargs.pop("headers", None) or {})
+        if "Authorization" not in headers:
+            if use_token and self.token:
+                headers["Authorization"] = f"Bearer {self.token}"
+            elif self.api_key:
+                headers["Authorization"] = f"Bearer {self.api_key}"
+        kwargs["headers"] = headers
+        self._log("info", f"📤 发送 {method} 请求: {self.base_url}{path}")
+        if "json" in kwargs:
+            self._log("info", f"📦 请求体: {kwargs['json']}")
+
+        try:
+            res = await self._send(method, path, **kwargs)
+            self._log("info", f"📥 收到响应: HTTP {res.status_code}")
+            log_body = os.getenv("DUCKMAIL_LOG_BODY", "").strip().lower() in ("1", "true", "yes", "y", "on")
+            if res.content and (log_body or res.status_code >= 400):
+                try:
+                    self._log("info", f"📄 响应内容: {res.text[:500]}")
+                except Exception:
+                    pass
+            return res
+        except Exception as e:
+            self._log("error", f"❌ 网络请求失败: {e}")
+            raise
+
+    async def _send(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """发送请求；代理连接失败时直连重试一次，直连也失败则抛出原始异常"""
+        try:
+            return await self._client.request(method, path, **kwargs)
+        except Exception as e:
+            if not self.proxy or not is_proxy_error(e):
+                raise
+            self._log("warning", f"⚠️ 代理请求失败，尝试直连: {e}")
+            if self._direct_client is None:
+                self._direct_client = self._build_client(None)
+            try:
+                return await self._direct_client.request(method, path, **kwargs)
+            except Exception:
+                raise e
+
+    async def register_account(self, domain: Optional[str] = None) -> bool:
+        """注册新邮箱账号"""
+        if not domain:
+            self._log("info", "🔍 正在获取可用域名...")
+            domain = await self._get_domain()
+        self._log("info", f"📧 使用域名: {domain}")
+
+        self.email, self.password = generate_credentials(domain)
+        self._log("info", f"🎲 生成邮箱: {self.email}")
+        self._log("info", f"🔑 生成密码: {self.password}")
+
+        try:
+            self._log("info", "📤 正在向 DuckMail 发送注册请求...")
+            res = await self._request(
+                "POST",
+                "/accounts",
+                use_token=False,
+                json={"address": self.email, "password": self.password},
+            )
+            if res.status_code in (200, 201):
+                data = json_body(res)
+                self.account_id = data.get("id")
+                self._log("info", f"✅ DuckMail 注册成功，账户ID: {self.account_id}")
+                return True
+            else:
+                self._log("error", f"❌ DuckMail 注册失败: HTTP {res.status_code}")
+                # 域名可能已下线或不属于当前 api_key，清除缓存以便下次重新获取
+                if 400 <= res.status_code < 500:
+                    self._drop_cached_domain(domain)
+        except Exception as e:
+            self._log("error", f"❌ DuckMail 注册异常: {e}")
+            return False
+
+        self._log("error", "❌ DuckMail 注册失败")
+        return False
+
+    async def login(self) -> bool:
+        """登录获取token"""
+        self._login_rejected = False
+        if not self.email or not self.password:
+            self._log("error", "❌ 邮箱或密码未设置")
+            return False
+
+        try:
+            self._log("info", f"🔐 正在登录 DuckMail: {self.email}")
+            res = await self._request(
+                "POST",
+                "/token",
+                use_token=False,
+                json={"address": self.email, "password": self.password},
+            )
+            if res.status_code == 200:
+                data = json_body(res)
+                token = data.get("token")
+                if token:
+                    self.token = token
+                    self._token_acquired_at = time.time()
+                    self._log("info", f"✅ DuckMail 登录成功，Token: {token[:20]}...")
+                    return True
+                else:
+                    self._log("error", "❌ 响应中未找到 Token")
+            else:
+                self._log("error", f"❌ DuckMail 登录失败: HTTP {res.status_code}")
+                self._login_rejected = is_login_rejected(res.status_code)
+        except Exception as e:
+            self._log("error", f"❌ DuckMail 登录异常: {e}")
+            return False
+
+        self._log("error", "❌ DuckMail 登录失败")
+        return False
+
+    def _invalidate_token(self) -> None:
+        """清除已缓存的token"""
+        self.token = None
+        self._token_acquired_at = 0.0
+
+    def _token_expired(self) -> bool:
+        return time.time() - self._token_acquired_at > self._token_ttl
+
+    async def fetch_verification_code(self, since_time=None) -> Optional[str]:
+        """获取验证码"""
+        try:
+            return await self._fetch_code(since_time)
+        except (AuthExpiredError, AccountGoneError):
+            return None
+
+    async def _fetch_code(self, since_time=None) -> Optional[str]:
+        """获取验证码；认证失效或账户不存在时抛出异常，便于轮询提前结束"""
+        if not self.token or self._token_expired():
+            self._log("info", "🔐 Token 不存在或已过期，尝试重新登录...")
+            self._invalidate_token()
+            if not await self.login():
+                self._log("error", "❌ 登录失败，无法获取验证码")
+                return None
+
+        try:
+            self._log("info", "📬 正在拉取邮件列表...")
+            params = build_messages_params(since_time)
+
+            list_headers = {}
+            if self._messages_etag and params == self._messages_params:
+                list_headers["If-None-Match"] = self._messages_etag
+            res = await self._request("GET", "/messages", params=params, headers=list_headers)
+
+            if res.status_code == 401:
+                self._log("warning", "⚠️ Token 已失效，尝试重新登录...")
+                self._invalidate_token()
+                if not await self.login():
+                    self._log("error", "❌ 重新登录失败，无法获取验证码")
+                    # 仅在服务端明确拒绝时结束轮询，临时故障下次轮询再试
+                    if self._login_rejected:
+                        raise AuthExpiredError()
+                    return None
+                res = await self._request("GET", "/messages", params=params, headers=list_headers)
+                if res.status_code == 401:
+                    self._log("error", "❌ 重新登录后 Token 仍被拒绝")
+                    raise AuthExpiredError()
+
+            if res.status_code == 404:
+                self._log("error", "❌ 邮箱账户不存在或已被删除")
+                raise AccountGoneError()
+
+            if res.status_code == 304:
+                self._log("info", "📪 邮件列表未变化，使用缓存")
+                messages = self._messages_cache
+            elif res.status_code == 200:
+                data = json_body(res)
+                messages = data.get("hydra:member", [])
+                self._messages_etag = res.headers.get("ETag")
+                self._messages_params = params
+                self._messages_cache = messages
+            else:
+                self._log("error", f"❌ 获取邮件列表失败: HTTP {res.status_code}")
+                return None
+
+            if not messages:
+                self._log("info", "📭 邮箱为空，暂无邮件")
+                return None
+
+            self._log("info", f"📨 收到 {len(messages)} 封邮件，开始检查验证码...")
+
+            # 按时间倒序，优先检查最新邮件
+            candidate_ids = [msg_id for _, msg_id in select_candidates(messages, since_time)]
+            if not candidate_ids:
+                self._log("info", "📭 暂无新邮件")
+                return None
+
+            # 并发读取邮件详情，按时间顺序取最新邮件中的验证码
+            results = await asyncio.gather(
+                *(self._fetch_detail_code(msg_id) for msg_id in candidate_ids),
+                return_exceptions=True,
+            )
+            for code in results:
+                if isinstance(code, Exception):
+                    self._log("warning", f"⚠️ 读取邮件详情异常: {code}")
+                    continue
+                if code:
+                    self._log("info", f"✅ 找到验证码: {code}")
+                    return code
+
+            self._log("warning", "⚠️ 所有邮件中均未找到验证码")
+            return None
+
+        except (AuthExpiredError, AccountGoneError):
+            raise
+        except Exception as e:
+            self._log("error", f"❌ 获取验证码异常: {e}")
+            return None
+
+    async def _fetch_detail_code(self, msg_id: str) -> Optional[str]:
+        """读取单封邮件并提取验证码（已读取过的邮件直接使用缓存）"""
+        payload = self._message_details.get(msg_id)
+        if payload is None:
+            self._log("info", f"🔍 正在读取邮件 (ID: {msg_id[:10]}...)")
+            detail = await self._request("GET", f"/messages/{msg_id}")
+            if detail.status_code != 200:
+                self._log("warning", f"⚠️ 读取邮件详情失败: HTTP {detail.status_code}")
+                return None
+            payload = json_body(detail)
+            self._message_details[msg_id] = payload
+
+        return extract_code_from_payload(payload, self._log)
+
+    async def poll_for_code(
+        self,
+        timeout: int = 120,
+        interval: int = 4,
+        since_time=None,
+    ) -> Optional[str]:
+        """轮询获取验证码（间隔按指数退避递增）"""
+        if not self.token:
+            self._log("info", "🔐 Token 不存在，尝试登录...")
+            if not await self.login():
+                self._log("error", "❌ 登录失败，无法轮询验证码")
+                return None
+
+        self._log("info", f"⏱️ 开始轮询验证码 (超时 {timeout}秒, 初始间隔 {interval}秒)")
+        deadline = time.time() + timeout
+
+        i = 0
+        while True:
+            i += 1
+            self._log("info", f"🔄 第 {i} 次轮询...")
+            try:
+                code = await self._fetch_code(since_time=since_time)
+            except (AuthExpiredError, AccountGoneError):
+                self._log("error", "❌ 邮箱已不可用，停止轮询")
+                return None
+            if code:
+                self._log("info", f"🎉 验证码获取成功: {code}")
+                return code
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+
+            delay = backoff_delay(interval, i, remaining)
+            self._log("info", f"⏳ 等待 {delay:.1f} 秒后重试...")
+            await asyncio.sleep(delay)
+
+        self._log("error", f"⏰ 验证码获取超时 ({timeout}秒)")
+        return None
+
+    def _domain_cache_key(self) -> tuple:
+        return (self.base_url, self.api_key)
+
+    def _drop_cached_domain(self, domain: str) -> None:
+        key = self._domain_cache_key()
+        if self._domain_cache.get(key) == domain:
+            self._domain_cache.pop(key, None)
+
+    async def _get_domain(self) -> str:
+        """获取可用域名"""
+        cached = self._domain_cache.get(self._domain_cache_key())
+        if cached:
+            return cached
+
+        try:
+            res = await self._request("GET", "/domains", use_token=False)
+            if res.status_code == 200:
+                data = json_body(res)
+                members = data.get("hydra:member", [])
+                if members:
+                    domain = members[0].get("domain")
+                    if domain:
+                        self._domain_cache[self._domain_cache_key()] = domain
+                        return domain
+        except Exception:
+            pass
+        return DEFAULT_DOMAIN
@@ -1,18 +1,104 @@
 import os
-import random
-import string
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.cookiejar import DefaultCookiePolicy
 from typing import Optional
 
 import requests
-
-from core.mail_utils import extract_verification_code
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
+
+from core.duckmail_common import (
+    DEFAULT_DOMAIN,
+    TOKEN_TTL,
+    AccountGoneError,
+    AuthExpiredError,
+    backoff_delay,
+    build_messages_params,
+    extract_code_from_payload,
+    generate_credentials,
+    is_login_rejected,
+    json_body,
+    make_logger,
+    parse_push_event,
+    select_candidates,
+)
 from core.proxy_utils import request_with_proxy_fallback
 
+# 进程内共享的连接池，按 (base_url, verify_ssl) 区分（代理按请求传入，不影响连接池）
+_SESSION_POOL: dict[tuple, requests.Session] = {}
+_SESSION_LOCK = threading.Lock()
+# 共享 Session 跨多个邮箱账户使用，不保存任何 Cookie
+_NO_COOKIES = DefaultCookiePolicy(allowed_domains=[])
+
+
+def _build_session(verify_ssl: bool) -> requests.Session:
+    """创建带连接池与重试策略的 Session（Keep-Alive 复用，避免每次请求重新握手）"""
+    session = requests.Session()
+    session.cookies.set_policy(_NO_COOKIES)
+    # verify 仍需按请求传入：环境变量 REQUESTS_CA_BUNDLE 会覆盖 session.verify
+    session.verify = verify_ssl
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False,
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _get_shared_session(base_url: str, verify_ssl: bool) -> requests.Session:
+    key = (base_url, verify_ssl)
+    with _SESSION_LOCK:
+        session = _SESSION_POOL.get(key)
+        if session is None:
+            session = _SESSION_POOL[key] = _build_session(verify_ssl)
+        return session
+
+
+def close_shared_sessions() -> None:
+    """关闭所有共享连接池（如进程退出前调用），之后新建的客户端会重新创建连接池"""
+    with _SESSION_LOCK:
+        sessions = list(_SESSION_POOL.values())
+        _SESSION_POOL.clear()
+    for session in sessions:
+        session.close()
+
+
+def _is_read_timeout(exc: Exception) -> bool:
+    """流式读取时 requests 会把 urllib3 的读超时包装成 ConnectionError"""
+    if isinstance(exc, requests.exceptions.ReadTimeout):
+        return True
+    return bool(exc.args) and isinstance(exc.args[0], ReadTimeoutError)
+
+
+class _BearerAuth(AuthBase):
+    """按实例附加 Bearer Token（共享 Session 上不保存认证头）"""
+
+    def __init__(self) -> None:
+        self.token: Optional[str] = None
+
+    def __call__(self, r):
+        if self.token:
+            r.headers["Authorization"] = f"Bearer {self.token}"
+        return r
+
 
 class DuckMailClient:
     """DuckMail客户端"""
 
+    # 可用域名缓存（按 (base_url, api_key) 区分，所有实例共享）
+    _domain_cache: dict[tuple, str] = {}
+
     def __init__(
         self,
         base_url: str = "https://api.duckmail.sbs",
@@ -26,20 +112,53 @@ class DuckMailClient:
         self.proxies = {"http": proxy, "https": proxy} if proxy else None
         self.api_key = api_key.strip()
         self.log_callback = log_callback
+        # 初始化时绑定日志函数，避免每次调用都判断 log_callback
+        self._log = make_logger(log_callback)
 
         self.email: Optional[str] = None
         self.password: Optional[str] = None
         self.account_id: Optional[str] = None
         self.token: Optional[str] = None
+        self._token_acquired_at: float = 0.0
+        self._token_ttl = TOKEN_TTL
+        # 最近一次登录是否被服务端明确拒绝（4xx），网络异常或 5xx 不算
+        self._login_rejected = False
+
+        # 邮件列表条件请求缓存（ETag / If-None-Match）及邮件详情缓存
+        self._messages_etag: Optional[str] = None
+        self._messages_params: Optional[dict] = None
+        self._messages_cache: list = []
+        self._message_details: dict[str, dict] = {}
+
+        # 推送连接的单次读超时（秒），超时后重新订阅
+        self._sse_read_timeout = 15
+
+        # 同一服务端的所有实例共享连接池
+        self._session = _get_shared_session(self.base_url, verify_ssl)
+        self._auth = _BearerAuth()
+
+    def close(self) -> None:
+        """释放实例持有的认证信息（共享连接池由其他实例继续复用，需关闭时调用 close_shared_sessions）"""
+        self._invalidate_token()
+
+    def __enter__(self) -> "DuckMailClient":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
 
     def set_credentials(self, email: str, password: str) -> None:
         self.email = email
         self.password = password
 
-    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
-        """发送请求并打印详细日志"""
-        headers = kwargs.pop("headers", None) or {}
-        if self.api_key and "Authorization" not in headers:
+    def _request(self, method: str, url: str, use_token: bool = True, **kwargs) -> requests.Response:
+        """发送请求并打印详细日志
+
+        use_token=False 时不附加邮箱 Token，仅使用 api_key（注册、登录、获取域名）
+        """
+        # 复制一份，避免把认证头写回调用方的 dict（重试时会带上旧 Token）
+        headers = dict(kwargs.pop("headers", None) or {})
+        if self.api_key and "Authorization" not in headers and not (use_token and self._auth.token):
             headers["Authorization"] = f"Bearer {self.api_key}"
         kwargs["headers"] = headers
         self._log("info", f"📤 发送 {method} 请求: {url}")
@@ -47,12 +166,14 @@ class DuckMailClient:
             self._log("info", f"📦 请求体: {kwargs['json']}")
 
         try:
+            # proxies 按请求传入，以便代理失败时 request_with_proxy_fallback 回退直连
             res = request_with_proxy_fallback(
-                requests.request,
+                self._session.request,
                 method,
                 url,
                 proxies=self.proxies,
                 verify=self.verify_ssl,
+                auth=self._auth if use_token else None,
                 timeout=kwargs.pop("timeout", 15),
                 **kwargs,
             )
@@ -77,10 +198,7 @@ class DuckMailClient:
         self._log("info", f"📧 使用域名: {domain}")
 
         # 生成随机邮箱和密码
-        rand = "".join(random.choices(string.ascii_lowercase + string.digits, k=10))
-        timestamp = str(int(time.time()))[-4:]
-        self.email = f"t{timestamp}{rand}@{domain}"
-        self.password = f"Pwd{rand}{timestamp}"
+        self.email, self.password = generate_credentials(domain)
         self._log("info", f"🎲 生成邮箱: {self.email}")
         self._log("info", f"🔑 生成密码: {self.password}")
 
@@ -89,15 +207,19 @@ class DuckMailClient:
             res = self._request(
                 "POST",
                 f"{self.base_url}/accounts",
+                use_token=False,
                 json={"address": self.email, "password": self.password},
             )
             if res.status_code in (200, 201):
-                data = res.json() if res.content else {}
+                data = json_body(res)
                 self.account_id = data.get("id")
                 self._log("info", f"✅ DuckMail 注册成功，账户ID: {self.account_id}")
                 return True
             else:
                 self._log("error", f"❌ DuckMail 注册失败: HTTP {res.status_code}")
+                # 域名可能已下线或不属于当前 api_key，清除缓存以便下次重新获取
+                if 400 <= res.status_code < 500:
+                    self._drop_cached_domain(domain)
         except Exception as e:
             self._log("error", f"❌ DuckMail 注册异常: {e}")
             return False
@@ -107,6 +229,7 @@ class DuckMailClient:
 
     def login(self) -> bool:
         """登录获取token"""
+        self._login_rejected = False
         if not self.email or not self.password:
             self._log("error", "❌ 邮箱或密码未设置")
             return False
@@ -116,19 +239,23 @@ class DuckMailClient:
             res = self._request(
                 "POST",
                 f"{self.base_url}/token",
+                use_token=False,
                 json={"address": self.email, "password": self.password},
             )
             if res.status_code == 200:
-                data = res.json() if res.content else {}
+                data = json_body(res)
                 token = data.get("token")
                 if token:
                     self.token = token
+                    self._token_acquired_at = time.time()
+                    self._auth.token = token
                     self._log("info", f"✅ DuckMail 登录成功，Token: {token[:20]}...")
                     return True
                 else:
                     self._log("error", "❌ 响应中未找到 Token")
             else:
                 self._log("error", f"❌ DuckMail 登录失败: HTTP {res.status_code}")
+                self._login_rejected = is_login_rejected(res.status_code)
         except Exception as e:
             self._log("error", f"❌ DuckMail 登录异常: {e}")
             return False
@@ -136,169 +263,302 @@ class DuckMailClient:
         self._log("error", "❌ DuckMail 登录失败")
         return False
 
+    def _invalidate_token(self) -> None:
+        """清除已缓存的token"""
+        self.token = None
+        self._token_acquired_at = 0.0
+        self._auth.token = None
+
+    def _token_expired(self) -> bool:
+        return time.time() - self._token_acquired_at > self._token_ttl
+
     def fetch_verification_code(self, since_time=None) -> Optional[str]:
         """获取验证码"""
-        if not self.token:
-            self._log("info", "🔐 Token 不存在，尝试重新登录...")
+        try:
+            return self._fetch_code(since_time)
+        except (AuthExpiredError, AccountGoneError):
+            return None
+
+    def _fetch_code(self, since_time=None) -> Optional[str]:
+        """获取验证码；认证失效或账户不存在时抛出异常，便于轮询提前结束"""
+        if not self.token or self._token_expired():
+            self._log("info", "🔐 Token 不存在或已过期，尝试重新登录...")
+            self._invalidate_token()
             if not self.login():
                 self._log("error", "❌ 登录失败，无法获取验证码")
                 return None
 
         try:
             self._log("info", "📬 正在拉取邮件列表...")
-            # 获取邮件列表
-            res = self._request(
-                "GET",
-                f"{self.base_url}/messages",
-                headers={"Authorization": f"Bearer {self.token}"},
-            )
-
-            if res.status_code != 200:
+            # 获取邮件列表（带 ETag 时服务端未变化会返回 304）
+            params = build_messages_params(since_time)
+
+            list_headers = {}
+            if self._messages_etag and params == self._messages_params:
+                list_headers["If-None-Match"] = self._messages_etag
+            res = self._request("GET", f"{self.base_url}/messages", params=params, headers=list_headers)
+
+            if res.status_code == 401:
+                self._log("warning", "⚠️ Token 已失效，尝试重新登录...")
+                self._invalidate_token()
+                if not self.login():
+                    self._log("error", "❌ 重新登录失败，无法获取验证码")
+                    # 仅在服务端明确拒绝时结束轮询，临时故障下次轮询再试
+                    if self._login_rejected:
+                        raise AuthExpiredError()
+                    return None
+                res = self._request("GET", f"{self.base_url}/messages", params=params, headers=list_headers)
+                if res.status_code == 401:
+                    self._log("error", "❌ 重新登录后 Token 仍被拒绝")
+                    raise AuthExpiredError()
+
+            if res.status_code == 404:
+                self._log("error", "❌ 邮箱账户不存在或已被删除")
+                raise AccountGoneError()
+
+            if res.status_code == 304:
+                self._log("info", "📪 邮件列表未变化，使用缓存")
+                messages = self._messages_cache
+            elif res.status_code == 200:
+                data = json_body(res)
+                messages = data.get("hydra:member", [])
+                self._messages_etag = res.headers.get("ETag")
+                self._messages_params = params
+                self._messages_cache = messages
+            else:
                 self._log("error", f"❌ 获取邮件列表失败: HTTP {res.status_code}")
                 return None
 
-            data = res.json() if res.content else {}
-            messages = data.get("hydra:member", [])
-
             if not messages:
                 self._log("info", "📭 邮箱为空，暂无邮件")
                 return None
 
             self._log("info", f"📨 收到 {len(messages)} 封邮件，开始检查验证码...")
 
-            from datetime import datetime
-            import re
-
-            def _parse_message_time(msg_obj) -> Optional[datetime]:
-                created_at = msg_obj.get("createdAt")
-                if created_at is None:
-                    return None
-
-                if isinstance(created_at, (int, float)):
-                    timestamp = float(created_at)
-                    if timestamp > 1e12:
-                        timestamp = timestamp / 1000.0
-                    return datetime.fromtimestamp(timestamp).astimezone().replace(tzinfo=None)
-
-                if isinstance(created_at, str):
-                    raw = created_at.strip()
-                    if not raw:
-                        return None
-                    if raw.isdigit():
-                        timestamp = float(raw)
-                        if timestamp > 1e12:
-                            timestamp = timestamp / 1000.0
-                        return datetime.fromtimestamp(timestamp).astimezone().replace(tzinfo=None)
-
-                    # 截断纳秒到微秒（fromisoformat 只支持6位小数）
-                    raw = re.sub(r"(\.\d{6})\d+", r"\1", raw)
-                    return datetime.fromisoformat(raw.replace("Z", "+00:00")).astimezone().replace(tzinfo=None)
-
-                return None
-
             # 按时间倒序，优先检查最新邮件
-            messages_with_time = [(msg, _parse_message_time(msg)) for msg in messages]
-            if any(item[1] is not None for item in messages_with_time):
-                messages_with_time.sort(key=lambda item: item[1] or datetime.min, reverse=True)
-                messages = [item[0] for item in messages_with_time]
-
-            # 遍历邮件，过滤时间
-            for idx, msg in enumerate(messages, 1):
-                msg_id = msg.get("id")
-                if not msg_id:
-                    continue
-
-                # 时间过滤
-                if since_time:
-                    msg_time = _parse_message_time(msg)
-                    if msg_time and msg_time < since_time:
-                        continue
+            candidates = select_candidates(messages, since_time)
+            if not candidates:
+                self._log("info", "📭 暂无新邮件")
+                return None
 
+            def _fetch_detail(idx: int, msg_id: str) -> Optional[str]:
                 self._log("info", f"🔍 正在读取邮件 {idx}/{len(messages)} (ID: {msg_id[:10]}...)")
-                detail = self._request(
-                    "GET",
-                    f"{self.base_url}/messages/{msg_id}",
-                    headers={"Authorization": f"Bearer {self.token}"},
-                )
-
-                if detail.status_code != 200:
-                    self._log("warning", f"⚠️ 读取邮件详情失败: HTTP {detail.status_code}")
-                    continue
-
-                payload = detail.json() if detail.content else {}
-
-                # 获取邮件内容
-                text_content = payload.get("text") or ""
-                html_content = payload.get("html") or ""
-
-                if isinstance(html_content, list):
-                    html_content = "".join(str(item) for item in html_content)
-                if isinstance(text_content, list):
-                    text_content = "".join(str(item) for item in text_content)
-
-                content = text_content + html_content
-                self._log("info", f"📄 邮件内容预览: {content[:200]}...")
-
-                code = extract_verification_code(content)
-                if code:
-                    self._log("info", f"✅ 找到验证码: {code}")
-                    return code
-                else:
+                payload = self._get_message_detail(msg_id)
+                if payload is None:
+                    return None
+                code = extract_code_from_payload(payload, self._log)
+                if not code:
                     self._log("info", f"❌ 邮件 {idx} 中未找到验证码")
+                return code
+
+            # 并发读取邮件详情；按时间顺序返回最新邮件中的验证码
+            executor = ThreadPoolExecutor(max_workers=min(8, len(candidates)))
+            try:
+                futures = {executor.submit(_fetch_detail, idx, msg_id): msg_id for idx, msg_id in candidates}
+                results: dict[str, Optional[str]] = {}
+                for future in as_completed(futures):
+                    try:
+                        results[futures[future]] = future.result()
+                    except Exception as e:
+                        self._log("warning", f"⚠️ 读取邮件详情异常: {e}")
+                        results[futures[future]] = None
+
+                    for _, msg_id in candidates:
+                        if msg_id not in results:
+                            break
+                        code = results[msg_id]
+                        if code:
+                            self._log("info", f"✅ 找到验证码: {code}")
+                            return code
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
 
             self._log("warning", "⚠️ 所有邮件中均未找到验证码")
             return None
 
+        except (AuthExpiredError, AccountGoneError):
+            raise
         except Exception as e:
             self._log("error", f"❌ 获取验证码异常: {e}")
             return None
 
+    def _get_message_detail(self, msg_id: str) -> Optional[dict]:
+        """获取邮件详情（已读取过的邮件直接使用缓存）"""
+        payload = self._message_details.get(msg_id)
+        if payload is not None:
+            return payload
+
+        detail = self._request("GET", f"{self.base_url}/messages/{msg_id}")
+        if detail.status_code != 200:
+            self._log("warning", f"⚠️ 读取邮件详情失败: HTTP {detail.status_code}")
+            return None
+
+        payload = json_body(detail)
+        self._message_details[msg_id] = payload
+        return payload
+
     def poll_for_code(
         self,
         timeout: int = 120,
         interval: int = 4,
         since_time=None,
     ) -> Optional[str]:
-        """轮询获取验证码"""
+        """轮询获取验证码（间隔按指数退避递增）"""
         if not self.token:
             self._log("info", "🔐 Token 不存在，尝试登录...")
             if not self.login():
                 self._log("error", "❌ 登录失败，无法轮询验证码")
                 return None
 
-        max_retries = max(1, timeout // interval)
-        self._log("info", f"⏱️ 开始轮询验证码 (超时 {timeout}秒, 间隔 {interval}秒, 最多 {max_retries} 次)")
+        self._log("info", f"⏱️ 开始轮询验证码 (超时 {timeout}秒, 初始间隔 {interval}秒)")
+        deadline = time.time() + timeout
 
-        for i in range(1, max_retries + 1):
-            self._log("info", f"🔄 第 {i}/{max_retries} 次轮询...")
-            code = self.fetch_verification_code(since_time=since_time)
+        i = 0
+        while True:
+            i += 1
+            self._log("info", f"🔄 第 {i} 次轮询...")
+            try:
+                code = self._fetch_code(since_time=since_time)
+            except (AuthExpiredError, AccountGoneError):
+                self._log("error", "❌ 邮箱已不可用，停止轮询")
+                return None
             if code:
                 self._log("info", f"🎉 验证码获取成功: {code}")
                 return code
 
-            if i < max_retries:
-                self._log("info", f"⏳ 等待 {interval} 秒后重试...")
-                time.sleep(interval)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+
+            delay = backoff_delay(interval, i, remaining)
+            self._log("info", f"⏳ 等待 {delay:.1f} 秒后重试...")
+            time.sleep(delay)
 
         self._log("error", f"⏰ 验证码获取超时 ({timeout}秒)")
         return None
 
+    def poll_for_code_sse(self, timeout: int = 120, since_time=None) -> Optional[str]:
+        """通过 Mercure SSE 订阅新邮件获取验证码，连接失败时回退到轮询"""
+        if not self.token:
+            self._log("info", "🔐 Token 不存在，尝试登录...")
+            if not self.login():
+                self._log("error", "❌ 登录失败，无法获取验证码")
+                return None
+
+        deadline = time.time() + timeout
+
+        if not self.account_id:
+            self._log("warning", "⚠️ 缺少账户ID，无法订阅推送，回退到轮询")
+            return self.poll_for_code(timeout=timeout, since_time=since_time)
+
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+
+            try:
+                code = self._listen_sse(since_time, deadline, read_timeout=min(remaining, self._sse_read_timeout))
+                if code:
+                    self._log("info", f"🎉 验证码获取成功: {code}")
+                    return code
+            except (AuthExpiredError, AccountGoneError):
+                self._log("error", "❌ 邮箱已不可用，停止获取验证码")
+                return None
+            except requests.RequestException as e:
+                # 读超时只说明这段时间内没有推送，重新订阅直到截止时间
+                if _is_read_timeout(e):
+                    continue
+                remaining = int(deadline - time.time())
+                if remaining > 0:
+                    self._log("warning", f"⚠️ 推送连接失败，回退到轮询: {e}")
+                    return self.poll_for_code(timeout=remaining, since_time=since_time)
+                break
+            else:
+                # 服务端提前关闭推送连接时，剩余时间改为轮询
+                remaining = int(deadline - time.time())
+                if remaining > 0:
+                    self._log("warning", "⚠️ 推送连接已关闭，回退到轮询")
+                    return self.poll_for_code(timeout=remaining, since_time=since_time)
+                break
+
+        self._log("error", f"⏰ 验证码获取超时 ({timeout}秒)")
+        return None
+
+    def _listen_sse(self, since_time, deadline: float, read_timeout: float) -> Optional[str]:
+        """订阅一次推送并读取事件，直到取得验证码、连接关闭或到达截止时间"""
+        self._log("info", "📡 正在订阅 DuckMail 新邮件推送...")
+        res = request_with_proxy_fallback(
+            self._session.get,
+            f"{self.base_url}/.well-known/mercure",
+            params={"topic": f"/accounts/{self.account_id}"},
+            proxies=self.proxies,
+            verify=self.verify_ssl,
+            auth=self._auth,
+            stream=True,
+            timeout=(10, read_timeout),
+        )
+        with res:
+            if res.status_code != 200:
+                raise requests.RequestException(f"HTTP {res.status_code}")
+
+            # 订阅建立后再检查已有邮件，之后到达的邮件由推送送达，不会遗漏
+            code = self._fetch_code(since_time=since_time)
+            if code:
+                return code
+
+            data_lines: list = []
+            # chunk_size=1：事件帧很小，按默认 512 字节缓冲会延迟到连接关闭才能读到
+            for line in res.iter_lines(chunk_size=1, decode_unicode=True):
+                if line:
+                    if line.startswith("data:"):
+                        data_lines.append(line[5:].strip())
+                elif data_lines:
+                    # 空行表示一个事件结束
+                    event_data = "\n".join(data_lines)
+                    data_lines = []
+                    code = self._code_from_event(event_data)
+                    if code:
+                        return code
+                if time.time() > deadline:
+                    break
+        return None
+
+    def _code_from_event(self, event_data: str) -> Optional[str]:
+        """解析 Mercure 推送事件并提取验证码"""
+        msg_id = parse_push_event(event_data)
+        if not msg_id:
+            return None
+
+        self._log("info", f"📨 收到新邮件推送 (ID: {msg_id[:10]}...)")
+        payload = self._get_message_detail(msg_id)
+        if payload is None:
+            return None
+        return extract_code_from_payload(payload, self._log)
+
+    def _domain_cache_key(self) -> tuple:
+        return (self.base_url, self.api_key)
+
+    def _drop_cached_domain(self, domain: str) -> None:
+        key = self._domain_cache_key()
+        if self._domain_cache.get(key) == domain:
+            self._domain_cache.pop(key, None)
+
     def _get_domain(self) -> str:
         """获取可用域名"""
+        cached = self._domain_cache.get(self._domain_cache_key())
+        if cached:
+            return cached
+
         try:
-            res = self._request("GET", f"{self.base_url}/domains")
+            res = self._request("GET", f"{self.base_url}/domains", use_token=False)
             if res.status_code == 200:
-                data = res.json() if res.content else {}
+                data = json_body(res)
                 members = data.get("hydra:member", [])
                 if members:
-                    return members[0].get("domain") or "duck.com"
+                    domain = members[0].get("domain")
+                    if domain:
+                        self._domain_cache[self._domain_cache_key()] = domain
+                        return domain
         except Exception:
             pass
-        return "duck.com"
-
-    def _log(self, level: str, message: str) -> None:
-        if self.log_callback:
-            try:
-                self.log_callback(level, message)
-            except Exception:
-                pass
+        return DEFAULT_DOMAIN
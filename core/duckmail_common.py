@@ -0,0 +1,172 @@
+"""
+DuckMail 同步/异步客户端共用的逻辑
+
+只包含与传输方式无关的部分：凭据生成、邮件列表参数、邮件筛选排序、
+验证码提取、轮询退避、日志回调包装以及错误类型。
+"""
+
+import functools
+import random
+import re
+import secrets
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
+from core.mail_utils import extract_verification_code_from_parts
+
+DEFAULT_DOMAIN = "duck.com"
+TOKEN_TTL = 3300
+
+# 截断纳秒到微秒（fromisoformat 只支持6位小数）
+_NANOS_RE = re.compile(r"(\.\d{6})\d+")
+_UTC_MIN = datetime.min.replace(tzinfo=timezone.utc)
+
+
+class AuthExpiredError(Exception):
+    """重新登录被拒绝，或重新登录后 Token 仍被拒绝（401）"""
+
+
+class AccountGoneError(Exception):
+    """邮箱账户已不存在（404）"""
+
+
+def _noop_log(level: str, message: str) -> None:
+    pass
+
+
+def _safe_log(callback, level: str, message: str) -> None:
+    try:
+        callback(level, message)
+    except Exception:
+        pass
+
+
+def make_logger(log_callback) -> Callable[[str, str], None]:
+    """绑定日志函数，避免每次调用都判断 log_callback；回调异常会被忽略"""
+    return functools.partial(_safe_log, log_callback) if log_callback else _noop_log
+
+
+def json_body(res):
+    """解析响应 JSON，兼容 requests 与 httpx 的 Response"""
+    return _json.loads(res.content) if res.content else {}
+
+
+def generate_credentials(domain: str) -> Tuple[str, str]:
+    """生成随机邮箱地址和密码"""
+    rand = secrets.token_hex(5)
+    t = int(time.time()) % 10000
+    email = "t%04d%s@%s" % (t, rand, domain)
+    password = "Pwd%s%04d" % (secrets.token_urlsafe(12), t)
+    return email, password
+
+
+def is_login_rejected(status_code: int) -> bool:
+    """登录是否被服务端明确拒绝（4xx，429 限流除外）"""
+    return 400 <= status_code < 500 and status_code != 429
+
+
+def parse_message_time(msg_obj) -> Optional[datetime]:
+    """解析邮件创建时间，统一返回 UTC aware datetime"""
+    created_at = msg_obj.get("createdAt")
+    if created_at is None:
+        return None
+
+    if isinstance(created_at, (int, float)):
+        timestamp = float(created_at)
+        if timestamp > 1e12:
+            timestamp = timestamp / 1000.0
+        return datetime.fromtimestamp(timestamp, timezone.utc)
+
+    if isinstance(created_at, str):
+        raw = created_at.strip()
+        if not raw:
+            return None
+        if raw.isdigit():
+            timestamp = float(raw)
+            if timestamp > 1e12:
+                timestamp = timestamp / 1000.0
+            return datetime.fromtimestamp(timestamp, timezone.utc)
+
+        raw = _NANOS_RE.sub(r"\1", raw)
+        parsed = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+        # 无时区信息时按本地时间处理
+        return parsed.astimezone(timezone.utc)
+
+    return None
+
+
+def build_messages_params(since_time=None) -> dict:
+    """邮件列表查询参数：时间过滤与排序交给服务端，只拉取新邮件且最新的排在最前"""
+    params = {"order[createdAt]": "desc"}
+    if since_time:
+        params["createdAt[after]"] = since_time.astimezone(timezone.utc).isoformat()
+    return params
+
+
+def select_candidates(messages: list, since_time=None) -> List[Tuple[int, str]]:
+    """按时间倒序筛选 since_time 之后的邮件，返回 (序号, 邮件ID)
+
+    服务端已按参数过滤排序，这里作为不支持时的兜底。
+    """
+    since_utc = since_time.astimezone(timezone.utc) if since_time else None
+
+    messages_with_time = [(msg, parse_message_time(msg)) for msg in messages]
+    if any(item[1] is not None for item in messages_with_time):
+        messages_with_time.sort(key=lambda item: item[1] or _UTC_MIN, reverse=True)
+
+    candidates = []
+    for idx, (msg, msg_time) in enumerate(messages_with_time, 1):
+        msg_id = msg.get("id")
+        if not msg_id:
+            continue
+        if since_utc and msg_time and msg_time < since_utc:
+            continue
+        candidates.append((idx, msg_id))
+    return candidates
+
+
+def message_parts(payload: dict) -> List[str]:
+    """取出邮件的纯文本与 HTML 正文（列表形式的正文按原样拼接）"""
+    parts = []
+    for key in ("text", "html"):
+        content = payload.get(key) or ""
+        # 避免关键词与验证码被拆到不同片段
+        if isinstance(content, list):
+            content = "".join(str(item) for item in content)
+        parts.append(content)
+    return parts
+
+
+def extract_code_from_payload(payload: dict, log=_noop_log) -> Optional[str]:
+    """从邮件详情中提取验证码（纯文本与 HTML 分段扫描，不拼接整封邮件）"""
+    parts = message_parts(payload)
+    preview = parts[0] or parts[1]
+    if preview:
+        log("info", f"📄 邮件内容预览: {preview[:200]}...")
+    return extract_verification_code_from_parts(parts)
+
+
+def parse_push_event(event_data: str) -> Optional[str]:
+    """解析 Mercure 推送事件，返回新邮件 ID"""
+    try:
+        msg = _json.loads(event_data)
+    except ValueError:
+        return None
+    if not isinstance(msg, dict):
+        return None
+    # 同一 topic 下还会推送账户更新事件
+    if msg.get("@type") not in (None, "Message"):
+        return None
+    return msg.get("id") or None
+
+
+def backoff_delay(interval: float, attempt: int, remaining: float) -> float:
+    """第 attempt 次轮询后的等待时间：按 1.5 倍递增，上限 15 秒，带少量抖动，不超过剩余时间"""
+    delay = min(interval * (1.5 ** (attempt - 1)), 15)
+    return min(delay + random.uniform(0, delay * 0.1), remaining)
@@ -1,29 +1,48 @@
 import re
-from typing import Optional
+from typing import Iterable, Optional
+
+# 预编译验证码匹配规则（模块加载时编译一次）
+_CONTEXT_CODE_RE = re.compile(r"(?:验证码|code|verification|passcode|pin).*?[:：]\s*([A-Za-z0-9]{4,8})\b", re.IGNORECASE)
+_CSS_UNIT_RE = re.compile(r"^\d+(?:px|pt|em|rem|vh|vw|%)$", re.IGNORECASE)
+_ALNUM6_RE = re.compile(r"[A-Z0-9]{6}")
+_DIGIT6_RE = re.compile(r"\b\d{6}\b")
 
 
 def extract_verification_code(text: str) -> Optional[str]:
     """提取验证码"""
-    if not text:
+    return extract_verification_code_from_parts((text,))
+
+
+def extract_verification_code_from_parts(parts: Iterable[str]) -> Optional[str]:
+    """从多段内容（如邮件纯文本与 HTML）中提取验证码
+
+    每个策略依次扫描所有段落后才进入下一个策略，结果与拼接后调用
+    extract_verification_code 一致，但不需要拼接出整封邮件。
+    """
+    parts = [part for part in parts if part]
+    if not parts:
         return None
 
-    # 策略1: 上下文关键词匹配（中英文冒号）
-    context_pattern = r"(?:验证码|code|verification|passcode|pin).*?[:：]\s*([A-Za-z0-9]{4,8})\b"
-    match = re.search(context_pattern, text, re.IGNORECASE)
-    if match:
-        candidate = match.group(1)
-        # 排除 CSS 单位值
-        if not re.match(r"^\d+(?:px|pt|em|rem|vh|vw|%)$", candidate, re.IGNORECASE):
-            return candidate
+    # 策略1: 上下文关键词匹配（中英文冒号），以第一处关键词匹配为准
+    for part in parts:
+        match = _CONTEXT_CODE_RE.search(part)
+        if match:
+            candidate = match.group(1)
+            # 排除 CSS 单位值
+            if not _CSS_UNIT_RE.match(candidate):
+                return candidate
+            break
 
     # 策略2: 6位字母数字混合（与测试代码一致，优先级提高）
-    match = re.search(r"[A-Z0-9]{6}", text)
-    if match:
-        return match.group(0)
+    for part in parts:
+        match = _ALNUM6_RE.search(part)
+        if match:
+            return match.group(0)
 
     # 策略3: 6位数字（降级为备选）
-    digits = re.findall(r"\b\d{6}\b", text)
-    if digits:
-        return digits[0]
+    for part in parts:
+        match = _DIGIT6_RE.search(part)
+        if match:
+            return match.group(0)
 
     return None
@@ -169,6 +169,33 @@ def normalize_proxy_url(proxy_str: str) -> str:
     return f"http://{proxy_str}"
 
 
+# 代理相关的错误类型（同时匹配 requests 与 httpx 的异常）
+PROXY_ERRORS = (
+    "ProxyError",
+    "ConnectTimeout",
+    "ConnectionError",
+    "ConnectError",  # httpx 连接失败
+    "407",  # Proxy Authentication Required
+    "502",  # Bad Gateway (代理问题)
+    "503",  # Service Unavailable (代理问题)
+)
+
+
+def is_proxy_error(exc: BaseException) -> bool:
+    """
+    判断异常是否可能由代理引起（可直连重试）
+
+    Args:
+        exc: 请求抛出的异常
+
+    Returns:
+        bool: 错误信息或异常类型匹配 PROXY_ERRORS 时返回 True
+    """
+    error_str = str(exc)
+    error_type = type(exc).__name__
+    return any(err in error_str or err in error_type for err in PROXY_ERRORS)
+
+
 def request_with_proxy_fallback(request_func: Callable, *args, **kwargs) -> Any:
     """
     带代理失败回退的请求包装器
@@ -185,27 +212,12 @@ def request_with_proxy_fallback(request_func: Callable, *args, **kwargs) -> Any:
     Raises:
         原始异常（如果直连也失败）
     """
-    # 代理相关的错误类型
-    PROXY_ERRORS = (
-        "ProxyError",
-        "ConnectTimeout",
-        "ConnectionError",
-        "407",  # Proxy Authentication Required
-        "502",  # Bad Gateway (代理问题)
-        "503",  # Service Unavailable (代理问题)
-    )
-
     try:
         # 首次尝试（使用代理）
         return request_func(*args, **kwargs)
     except Exception as e:
-        error_str = str(e)
-        error_type = type(e).__name__
-
         # 检查是否是代理相关错误
-        is_proxy_error = any(err in error_str or err in error_type for err in PROXY_ERRORS)
-
-        if is_proxy_error and "proxies" in kwargs:
+        if is_proxy_error(e) and "proxies" in kwargs:
             # 禁用代理重试
             original_proxies = kwargs.get("proxies")
             kwargs["proxies"] = None
@@ -67,6 +67,7 @@ from core.account import (
     bulk_delete_accounts as _bulk_delete_accounts
 )
 from core.proxy_utils import parse_proxy_setting
+from core.duckmail_client import close_shared_sessions
 
 # 导入 Uptime 追踪器
 from core import uptime as uptime_tracker
@@ -825,7 +826,7 @@ async def startup_event():
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """应用关闭时保存冷却状态"""
+    """应用关闭时保存冷却状态并释放连接池"""
     if storage.is_database_enabled():
         try:
             success_count = await account.save_all_cooldown_states(multi_account_mgr)
@@ -833,6 +834,9 @@ async def shutdown_event():
         except Exception as e:
             logger.error(f"[SYSTEM] 关闭时保存冷却状态失败: {e}")
 
+    # 释放 DuckMail 共享连接池
+    close_shared_sessions()
+
 
 async def save_cooldown_states_task():
     """定期保存所有账户的冷却状态到数据库"""
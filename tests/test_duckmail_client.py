@@ -0,0 +1,150 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from core.duckmail_async import AsyncDuckMailClient
+from core.duckmail_client import DuckMailClient
+
+
+class _FakeDuckMail(BaseHTTPRequestHandler):
+    """最小 DuckMail 服务端：Mercure 推送连接保持打开，按需推送事件"""
+
+    protocol_version = "HTTP/1.1"
+    state: dict = {}
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/token":
+            statuses = self.state.get("token_statuses")
+            if statuses:
+                return self._send_json(statuses.pop(0), {})
+            return self._send_json(200, {"token": "tok"})
+        self._send_json(404, {})
+
+    def do_GET(self) -> None:
+        path = self.path.split("?")[0]
+        if path == "/messages":
+            self.state.setdefault("list_auth", []).append(self.headers.get("Authorization"))
+            if self.headers.get("Authorization") == "Bearer stale":
+                return self._send_json(401, {})
+            return self._send_json(200, {"hydra:member": self.state.get("messages", [])})
+        if path.startswith("/messages/"):
+            return self._send_json(200, self.state["details"][path.rsplit("/", 1)[1]])
+        if path == "/.well-known/mercure":
+            self.state["subscriptions"] = self.state.get("subscriptions", 0) + 1
+            self.close_connection = True
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            # 不分块、不带 Content-Length：事件帧远小于 512 字节
+            self.send_header("Connection", "close")
+            self.end_headers()
+            delay = self.state.get("push_after")
+            if delay is not None:
+                time.sleep(delay)
+                self.state["details"] = {"m1": {"text": "Your verification code: 654321"}}
+                self.wfile.write(b'data: {"@type":"Message","id":"m1"}\n\n')
+                self.wfile.flush()
+            # 保持连接打开，不主动关闭
+            time.sleep(self.state.get("hold", 10))
+            return
+        self._send_json(404, {})
+
+
+@pytest.fixture
+def duckmail():
+    _FakeDuckMail.state = {}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeDuckMail)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = DuckMailClient(base_url=f"http://127.0.0.1:{server.server_address[1]}")
+    client.set_credentials("t@example.com", "pwd")
+    client.account_id = "acc1"
+    yield client, _FakeDuckMail.state
+    server.shutdown()
+    server.server_close()
+
+
+def test_sse_delivers_code_while_stream_stays_open(duckmail):
+    client, state = duckmail
+    state["push_after"] = 0.5
+
+    start = time.time()
+    code = client.poll_for_code_sse(timeout=10)
+
+    assert code == "654321"
+    assert time.time() - start < 3
+
+
+def test_sse_respects_timeout_when_no_event_arrives(duckmail):
+    client, state = duckmail
+    client._sse_read_timeout = 1
+
+    start = time.time()
+    code = client.poll_for_code_sse(timeout=3)
+
+    assert code is None
+    assert time.time() - start < 4.5
+    # 读超时后会重新订阅
+    assert state["subscriptions"] >= 2
+
+
+def test_relogin_retry_sends_fresh_token_with_cached_etag(duckmail):
+    client, state = duckmail
+    client.token = client._auth.token = "stale"
+    client._token_acquired_at = time.time()
+    client._messages_etag = '"v1"'
+    client._messages_params = {"order[createdAt]": "desc"}
+
+    assert client.fetch_verification_code() is None
+    assert state["list_auth"] == ["Bearer stale", "Bearer tok"]
+
+
+def test_transient_relogin_failure_keeps_polling(duckmail):
+    client, state = duckmail
+    client.token = client._auth.token = "stale"
+    client._token_acquired_at = time.time()
+    state["token_statuses"] = [503]
+    state["messages"] = [{"id": "m1"}]
+    state["details"] = {"m1": {"text": "Your verification code: 112233"}}
+
+    assert client.poll_for_code(timeout=5, interval=1) == "112233"
+
+
+def test_rejected_relogin_stops_polling(duckmail):
+    client, state = duckmail
+    client.token = client._auth.token = "stale"
+    client._token_acquired_at = time.time()
+    state["token_statuses"] = [401]
+
+    start = time.time()
+    assert client.poll_for_code(timeout=5, interval=1) is None
+    assert time.time() - start < 1
+
+
+def test_async_falls_back_to_direct_connection_on_proxy_error(duckmail):
+    client, state = duckmail
+    state["messages"] = [{"id": "m1"}]
+    state["details"] = {"m1": {"text": "Your verification code: 445566"}}
+
+    async def run():
+        # 代理端口无人监听，连接失败后应直连重试
+        async with AsyncDuckMailClient(base_url=client.base_url, proxy="http://127.0.0.1:1") as async_client:
+            async_client.set_credentials("t@example.com", "pwd")
+            return await async_client.fetch_verification_code()
+
+    assert asyncio.run(run()) == "445566"
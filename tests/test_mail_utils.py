@@ -0,0 +1,25 @@
+from core.duckmail_common import extract_code_from_payload
+from core.mail_utils import extract_verification_code, extract_verification_code_from_parts
+
+
+def test_extract_context_keyword_code():
+    assert extract_verification_code("Your verification code: x7k2m9") == "x7k2m9"
+
+
+def test_extract_skips_css_unit_context_match():
+    assert extract_verification_code("code: 100px then 482913") == "482913"
+
+
+def test_parts_keep_strategy_order_across_parts():
+    # 关键词匹配在 HTML 中，纯文本中只有宽松的大写匹配，应以关键词匹配为准
+    parts = ["Sign in to your GOOGLE account", "<p>Your verification code: x7k2m9</p>"]
+    assert extract_verification_code_from_parts(parts) == "x7k2m9"
+    assert extract_verification_code_from_parts(parts) == extract_verification_code("".join(parts))
+
+
+def test_duckmail_payload_matches_combined_extraction():
+    payload = {
+        "text": "Sign in to your GOOGLE account",
+        "html": ["<p>Your verification code", ": x7k2m9</p>"],
+    }
+    assert extract_code_from_payload(payload) == "x7k2m9"